@@ -0,0 +1,79 @@
+"""
+Functions for computing conserved-quantity diagnostics of saved simulations.
+"""
+import csv
+
+from storage import iterate_timesteps
+
+# Order of the columns in the diagnostics file.
+DIAGNOSTICS_COLUMNS = ["timestep", "current_time", "number_of_particles", \
+    "total_mass", "momentum_x", "momentum_y", "kinetic_energy", "merges", \
+    "emissions"]
+
+def compute_diagnostics(timestep_data, previous_ids=None):
+    """
+    Computes the diagnostics of a single timestep. The `previous_ids` 
+    parameter is the set of particle ids present in the previous timestep, 
+    it is used to count the number of particles that disappeared (merges) 
+    and appeared (emissions) since then. Returns the diagnostics dictionary 
+    and the set of particle ids present in this timestep.
+    """
+    particles = timestep_data["particles"]
+    
+    # Unpack particle columns.
+    ids = {particle[0] for particle in particles}
+    masses = [particle[3] for particle in particles]
+    velocities_x = [particle[2][0] for particle in particles]
+    velocities_y = [particle[2][1] for particle in particles]
+    
+    # Count merges and emissions.
+    if previous_ids is None:
+        merges = 0
+        emissions = 0
+    else:
+        merges = len(previous_ids - ids)
+        emissions = len(ids - previous_ids)
+    
+    diagnostics = {
+        "timestep": timestep_data["timestep"],
+        "current_time": timestep_data["current_time"],
+        "number_of_particles": len(particles),
+        "total_mass": sum(masses),
+        "momentum_x": sum(m * v for m, v in zip(masses, velocities_x)),
+        "momentum_y": sum(m * v for m, v in zip(masses, velocities_y)),
+        "kinetic_energy": sum(0.5 * m * (vx ** 2 + vy ** 2) \
+            for m, vx, vy in zip(masses, velocities_x, velocities_y)),
+        "merges": merges,
+        "emissions": emissions
+    }
+    return diagnostics, ids
+
+def iterate_diagnostics(simulation_name):
+    """
+    Generator yielding the diagnostics dictionary of every timestep of the 
+    simulation `simulation_name` in order. The timesteps are streamed from 
+    the save files, so only one chunk is in memory at any time.
+    """
+    previous_ids = None
+    for timestep_data in iterate_timesteps(simulation_name):
+        diagnostics, previous_ids = \
+            compute_diagnostics(timestep_data, previous_ids)
+        yield diagnostics
+
+def save_diagnostics(simulation_name, filename=None):
+    """
+    Writes the diagnostics of every timestep of the simulation 
+    `simulation_name` to a csv file, one row per timestep. The file is 
+    written to `saves/<simulation_name>/diagnostics.csv` if `filename` is 
+    None. Returns the filename.
+    """
+    if filename is None:
+        filename = f"saves/{simulation_name}/diagnostics.csv"
+    
+    with open(filename, "w", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=DIAGNOSTICS_COLUMNS)
+        writer.writeheader()
+        for diagnostics in iterate_diagnostics(simulation_name):
+            writer.writerow(diagnostics)
+    
+    return filename
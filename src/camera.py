@@ -95,3 +95,21 @@ class Camera:
         """
         # Return camera zoom.
         return self.zoom
+    
+    def get_visible_rectangle(self, window_dimensions, margin=0):
+        """
+        Returns the part of the simulation visible in a window with 
+        dimensions `window_dimensions` as a rectangle of the form 
+        (min_x, min_y, max_x, max_y). The rectangle is extended by `margin` 
+        pixels on every side.
+        """
+        window_width, window_height = window_dimensions
+        
+        # Invert the transformation used by the visualization.
+        min_x = (-margin - window_width // 2) / self.zoom + self.position[0]
+        max_x = (window_width + margin - window_width // 2) / self.zoom \
+            + self.position[0]
+        min_y = (-margin - window_height // 2) / self.zoom - self.position[1]
+        max_y = (window_height + margin - window_height // 2) / self.zoom \
+            - self.position[1]
+        return (min_x, min_y, max_x, max_y)
@@ -0,0 +1,209 @@
+"""
+Functions for converting pickle save directories to the compact format.
+Convert every simulation in the `saves` folder by executing 
+`python conversion.py [workers]`.
+"""
+import hashlib
+import multiprocessing
+import os
+import pickle
+import sys
+import time
+
+from storage import COMPACT_FORMAT_VERSION, SaveFileError, \
+    create_compact_index, get_chunk_filenames, get_chunk_index, \
+    get_missing_chunk_filename, is_compact, iterate_pickle_timesteps, \
+    pack_particles, pack_timestep, read_compact_timestep
+
+class ConversionError(Exception):
+    """
+    Raised when the save files of a simulation cannot be converted, or when 
+    the converted data does not match the original data.
+    """
+
+def iterate_original_timesteps(simulation_name):
+    """
+    Generator yielding the data dictionary of every timestep of the pickle 
+    save files of the simulation `simulation_name`. Raises a ConversionError 
+    if a save file cannot be read.
+    """
+    try:
+        yield from iterate_pickle_timesteps(simulation_name)
+    except SaveFileError as error:
+        raise ConversionError(str(error)) from error
+
+def convert_simulation(simulation_name, remove_originals=False, \
+    tile_size=None):
+    """
+    Converts the pickle save files of the simulation `simulation_name` to 
+    the compact format with tiles of size `tile_size`, and checks the result 
+    against the originals. The tile size is chosen for every timestep from 
+    the density of its particles if `tile_size` is None. The number of 
+    timesteps, the number of particles of every timestep, and a checksum of 
+    all particles sorted by id must be equal, else the conversion fails and 
+    the index is not written. The data is written to temporary files, which 
+    only replace the compact files after the check succeeded. Simulations 
+    that have already been converted are not converted again. The pickle 
+    save files are removed after a successful conversion if 
+    `remove_originals` is True.
+    Returns a report dictionary.
+    """
+    directory = f"saves/{simulation_name}/"
+    start_time = time.perf_counter()
+    report = {"simulation_name": simulation_name, "converted": False, \
+        "error": None, "timesteps": 0, "particles": 0, "original_bytes": 0, \
+        "converted_bytes": 0, "seconds": 0}
+    
+    # Do not convert a simulation twice, the originals might be removed.
+    if is_compact(simulation_name):
+        report["error"] = f"Simulation `{simulation_name}` has already " \
+            "been converted."
+        return report
+    
+    # Data is written to temporary files first.
+    data_filename = f"{directory}snapshots.bin"
+    index_filename = f"{directory}snapshots.pickle"
+    temporary_data_filename = f"{data_filename}.tmp"
+    temporary_index_filename = f"{index_filename}.tmp"
+    
+    try:
+        # Check if the save files are complete.
+        filenames = get_chunk_filenames(simulation_name)
+        if len(filenames) == 0:
+            raise ConversionError(f"No simulation files in `{directory}`.")
+        missing_filename = get_missing_chunk_filename(simulation_name)
+        if missing_filename is not None:
+            raise ConversionError("Missing simulation file " \
+                f"`{missing_filename}`.")
+        report["original_bytes"] = sum(os.path.getsize(filename) \
+            for filename in filenames)
+        
+        # Write the records of every timestep and compute the checksum of 
+        # the originals.
+        index = create_compact_index()
+        original_checksum = hashlib.sha256()
+        with open(temporary_data_filename, "wb") as file:
+            for timestep_data in iterate_original_timesteps(simulation_name):
+                particles = timestep_data["particles"]
+                if not timestep_data["number_of_particles"] == len(particles):
+                    raise ConversionError("Wrong number of particles in " \
+                        f"timestep `{timestep_data['timestep']}`.")
+                
+                data, number_of_tiles = pack_timestep(particles, tile_size)
+                index["timesteps"].append(timestep_data["timestep"])
+                index["current_times"].append(timestep_data["current_time"])
+                index["max_times"].append(timestep_data["max_time"])
+                index["numbers_of_particles"].append(len(particles))
+                index["numbers_of_tiles"].append(number_of_tiles)
+                index["offsets"].append(file.tell())
+                index["sizes"].append(len(data))
+                file.write(data)
+                
+                original_checksum.update(pack_particles(sorted(particles, \
+                    key=lambda particle: particle[0])))
+                
+                report["timesteps"] += 1
+                report["particles"] += len(particles)
+        
+        # Read back the converted data and compare it to the originals.
+        converted_checksum = hashlib.sha256()
+        timesteps = 0
+        particles = 0
+        with open(temporary_data_filename, "rb") as file:
+            for position in range(len(index["timesteps"])):
+                timestep_data = read_compact_timestep(file, index, position)
+                converted_checksum.update(\
+                    pack_particles(timestep_data["particles"]))
+                timesteps += 1
+                particles += len(timestep_data["particles"])
+        if not (timesteps == report["timesteps"] \
+            and particles == report["particles"] \
+            and converted_checksum.digest() == original_checksum.digest()):
+            raise ConversionError(f"Converted data of `{simulation_name}` " \
+                "does not match the original data.")
+        
+        # Write format version and index.
+        with open(temporary_index_filename, "wb") as file:
+            pickle.dump(COMPACT_FORMAT_VERSION, file)
+            pickle.dump(index, file)
+        
+        # Move the files into place. Any existing index is removed first 
+        # and the index is moved last, so the simulation only counts as 
+        # compact when both files are complete.
+        if os.path.exists(index_filename):
+            os.remove(index_filename)
+        os.replace(temporary_data_filename, data_filename)
+        os.replace(temporary_index_filename, index_filename)
+        report["converted_bytes"] = os.path.getsize(data_filename) \
+            + os.path.getsize(index_filename)
+        report["converted"] = True
+        
+        # Remove originals, including stray save files with a negative 
+        # index. Files with names that are not numbered were not converted 
+        # and are kept.
+        if remove_originals:
+            for file in os.listdir(directory):
+                if get_chunk_index(file) is not None:
+                    os.remove(f"{directory}{file}")
+    except (ConversionError, OSError) as error:
+        report["error"] = str(error)
+        
+        # Remove the temporary files written by this conversion.
+        for filename in [temporary_data_filename, temporary_index_filename]:
+            if os.path.exists(filename):
+                os.remove(filename)
+    
+    report["seconds"] = time.perf_counter() - start_time
+    return report
+
+def convert_all(workers=None, remove_originals=False, tile_size=None, \
+    simulation_names=None):
+    """
+    Converts every simulation in the `saves` folder that has not been 
+    converted yet, in parallel using a pool of `workers` processes. Only the 
+    simulations in `simulation_names` are converted if it is not None. The 
+    number of workers defaults to the number of cores. A simulation that 
+    fails does not stop the others. Prints the result of every simulation 
+    and the total throughput and space saved. Returns the list of reports.
+    """
+    # Find simulations that have not been converted yet.
+    if simulation_names is None:
+        simulation_names = sorted(os.listdir("saves"))
+    simulation_names = [name for name in simulation_names \
+        if os.path.isdir(f"saves/{name}/") and not is_compact(name)]
+    
+    # Convert simulations in parallel.
+    start_time = time.perf_counter()
+    with multiprocessing.Pool(workers) as pool:
+        reports = pool.starmap(convert_simulation, \
+            [(name, remove_originals, tile_size) \
+            for name in simulation_names])
+    seconds = time.perf_counter() - start_time
+    
+    # Print reports.
+    for report in reports:
+        if report["converted"]:
+            print(f"Converted `{report['simulation_name']}`: " \
+                f"{report['timesteps']} timesteps, " \
+                f"{report['particles']} particles, " \
+                f"{report['original_bytes']} -> " \
+                f"{report['converted_bytes']} bytes.")
+        else:
+            print(f"Failed `{report['simulation_name']}`: " \
+                f"{report['error']}")
+    
+    # Print totals.
+    converted = [report for report in reports if report["converted"]]
+    original_bytes = sum(report["original_bytes"] for report in converted)
+    converted_bytes = sum(report["converted_bytes"] for report in converted)
+    timesteps = sum(report["timesteps"] for report in converted)
+    print(f"Converted {len(converted)}/{len(reports)} simulations in " \
+        f"{round(seconds, 2)} seconds " \
+        f"({round(timesteps / max(seconds, 1e-9))} timesteps/s, " \
+        f"{round(original_bytes / 1e6 / max(seconds, 1e-9), 2)} MB/s).")
+    print(f"Space saved: {original_bytes - converted_bytes} bytes.")
+    
+    return reports
+
+if __name__ == "__main__":
+    convert_all(int(sys.argv[1]) if len(sys.argv) > 1 else None)
@@ -2,20 +2,243 @@
 Simulation class.
 """
 import copy
+import heapq
+import math
+import multiprocessing
 import os
 import pickle
 import random as rnd
+import statistics
+
+# Maximum number of boxes sampled to choose the grid cell size.
+CELL_SIZE_SAMPLES = 1000
+
+# Maximum number of grid cells a path box is inserted into. Circles with 
+# larger path boxes are kept out of the grid and tested against every other 
+# circle instead.
+MAX_GRID_CELLS = 16
+
+# View of the shared particle array of a worker process, set by 
+# `initialize_worker`.
+SHARED_PARTICLES = None
+
+def get_contact_time(particle1, particle2, delta_time, start_time=0):
+    """
+    Returns the time within [`start_time`, `delta_time`] at which the two 
+    moving circles first touch, or None if they do not touch within this 
+    interval. The positions of the particles are their positions at time 
+    zero. Circles that already overlap at `start_time` touch at 
+    `start_time`.
+    """
+    # Calculate relative position at the start time and relative velocity.
+    delta_vx = particle2[2][0] - particle1[2][0]
+    delta_vy = particle2[2][1] - particle1[2][1]
+    delta_x = particle2[1][0] - particle1[1][0] + delta_vx * start_time
+    delta_y = particle2[1][1] - particle1[1][1] + delta_vy * start_time
+    radius = particle1[4] + particle2[4]
+    
+    # Solve |delta_position + delta_velocity * t| = radius for t.
+    a = delta_vx ** 2 + delta_vy ** 2
+    b = 2 * (delta_x * delta_vx + delta_y * delta_vy)
+    c = delta_x ** 2 + delta_y ** 2 - radius ** 2
+    if c <= 0:
+        return start_time
+    if a == 0 or b >= 0:
+        return None
+    discriminant = b ** 2 - 4 * a * c
+    if discriminant < 0:
+        return None
+    contact_time = start_time + (-b - math.sqrt(discriminant)) / (2 * a)
+    if contact_time > delta_time:
+        return None
+    return contact_time
+
+def get_path_box(particle, start_time, delta_time):
+    """
+    Returns the bounding box (min_x, min_y, max_x, max_y) of the circle 
+    moving from its position at `start_time` to its position at 
+    `delta_time`. The position of the particle is its position at time zero.
+    """
+    position, velocity, radius = particle[1], particle[2], particle[4]
+    start_x = position[0] + velocity[0] * start_time
+    start_y = position[1] + velocity[1] * start_time
+    end_x = position[0] + velocity[0] * delta_time
+    end_y = position[1] + velocity[1] * delta_time
+    return (min(start_x, end_x) - radius, min(start_y, end_y) - radius, \
+        max(start_x, end_x) + radius, max(start_y, end_y) + radius)
+
+def get_grid_range(box, cell_size):
+    """
+    Returns the range (min_column, min_row, max_column, max_row) of the grid 
+    cells of size `cell_size` overlapped by the bounding box `box`.
+    """
+    return (math.floor(box[0] / cell_size), math.floor(box[1] / cell_size), \
+        math.floor(box[2] / cell_size), math.floor(box[3] / cell_size))
+
+def get_cell_size(particles, delta_time, samples=CELL_SIZE_SAMPLES):
+    """
+    Returns the grid cell size for the paths of the particles within the 
+    next `delta_time`: the median of the largest side of their path boxes, 
+    estimated from at most `samples` evenly spaced particles. A few fast 
+    circles do not change the cell size. Returns 1 if the paths have no 
+    size.
+    """
+    step = max(len(particles) // samples, 1)
+    sides = []
+    for particle in particles[::step]:
+        box = get_path_box(particle, 0, delta_time)
+        sides.append(max(box[2] - box[0], box[3] - box[1]))
+    cell_size = statistics.median(sides or [0])
+    if cell_size == 0:
+        return 1
+    return cell_size
+
+def find_contacts(particles, indices, delta_time, cell_size, \
+    min_column=None, max_column=None):
+    """
+    Finds the contacts within the next `delta_time` between the particles 
+    `particles[index]` for every index in `indices`, which must be in 
+    ascending order, in the region of grid columns from `min_column` up to 
+    but not including `max_column`. The region is unbounded on a side that 
+    is None.
+    
+    A pair is only reported by the region containing the first grid column 
+    both path boxes overlap, so regions can be searched independently. Every 
+    region must be given the particles whose path box overlaps it, including 
+    the halo of particles starting in a neighbouring region.
+    
+    Returns the list of contacts of the form (contact_time, index1, index2) 
+    with index1 < index2, the indices of the particles starting in the 
+    region with a path box overlapping more than `MAX_GRID_CELLS` cells, and 
+    the largest side of the other path boxes starting in the region.
+    """
+    # Insert the path boxes into the grid cells of the region. Boxes 
+    # overlapping too many cells are kept out of the grid.
+    boxes = {}
+    ranges = {}
+    grid = {}
+    large = []
+    home_large = []
+    max_side = 0
+    for index in indices:
+        box = get_path_box(particles[index], 0, delta_time)
+        cells = get_grid_range(box, cell_size)
+        if (min_column is not None and cells[2] < min_column) \
+            or (max_column is not None and cells[0] >= max_column):
+            continue
+        home = (min_column is None or cells[0] >= min_column) \
+            and (max_column is None or cells[0] < max_column)
+        boxes[index] = box
+        ranges[index] = cells
+        
+        if (cells[2] - cells[0] + 1) * (cells[3] - cells[1] + 1) \
+            > MAX_GRID_CELLS:
+            large.append(index)
+            if home:
+                home_large.append(index)
+            continue
+        if home:
+            max_side = max(max_side, box[2] - box[0], box[3] - box[1])
+        
+        first_column = cells[0] if min_column is None \
+            else max(cells[0], min_column)
+        last_column = cells[2] if max_column is None \
+            else min(cells[2], max_column - 1)
+        for cell_x in range(first_column, last_column + 1):
+            for cell_y in range(cells[1], cells[3] + 1):
+                grid.setdefault((cell_x, cell_y), []).append(index)
+    
+    # Test pairs sharing a grid cell in the first cell they share.
+    contacts = []
+    for (cell_x, cell_y), cell_indices in grid.items():
+        for position, index1 in enumerate(cell_indices):
+            range1 = ranges[index1]
+            for index2 in cell_indices[position + 1:]:
+                range2 = ranges[index2]
+                if not (max(range1[0], range2[0]) == cell_x \
+                    and max(range1[1], range2[1]) == cell_y):
+                    continue
+                contact_time = get_contact_time(particles[index1], \
+                    particles[index2], delta_time)
+                if contact_time is not None:
+                    contacts.append((contact_time, index1, index2))
+    
+    # Test the particles with large path boxes against every particle with 
+    # an overlapping path box, in the first column both boxes overlap.
+    large_indices = set(large)
+    for index1 in large:
+        box1 = boxes[index1]
+        for index2, box2 in boxes.items():
+            if index2 == index1 \
+                or (index2 in large_indices and index2 < index1) \
+                or box2[0] > box1[2] or box1[0] > box2[2] \
+                or box2[1] > box1[3] or box1[1] > box2[3]:
+                continue
+            column = max(ranges[index1][0], ranges[index2][0])
+            if (min_column is not None and column < min_column) \
+                or (max_column is not None and column >= max_column):
+                continue
+            contact_time = get_contact_time(particles[index1], \
+                particles[index2], delta_time)
+            if contact_time is not None:
+                first, second = sorted((index1, index2))
+                contacts.append((contact_time, first, second))
+    
+    return contacts, home_large, max_side
+
+def initialize_worker(shared_particles):
+    """
+    Stores a view of the shared particle array in the worker process, 
+    reading from the view does not copy the array.
+    """
+    global SHARED_PARTICLES
+    SHARED_PARTICLES = memoryview(shared_particles).cast("B").cast("d")
+
+def find_region_contacts(number_of_particles, capacity, delta_time, \
+    cell_size, min_column, max_column):
+    """
+    Runs `find_contacts` in a worker process for the region of grid columns 
+    from `min_column` up to but not including `max_column`. The particles 
+    are read from the shared particle array, which contains the columns of 
+    x positions, y positions, x velocities, y velocities, and radii, each 
+    `capacity` long. Only the particles whose path may overlap the region 
+    are unpacked.
+    """
+    pos_x, pos_y, vel_x, vel_y, radii = [SHARED_PARTICLES[\
+        column * capacity:column * capacity + number_of_particles] \
+        for column in range(5)]
+    
+    # Unpack the particles of the region and its halo, with a margin of a 
+    # cell against rounding.
+    min_x = -math.inf if min_column is None else (min_column - 1) * cell_size
+    max_x = math.inf if max_column is None else (max_column + 1) * cell_size
+    particles = {index: [index, [start_x, pos_y[index]], \
+        [velocity_x, vel_y[index]], None, radius] \
+        for index, (start_x, velocity_x, radius) \
+        in enumerate(zip(pos_x, vel_x, radii)) \
+        if start_x + (velocity_x * delta_time if velocity_x > 0 else 0) \
+            + radius >= min_x \
+        and start_x + (velocity_x * delta_time if velocity_x < 0 else 0) \
+            - radius <= max_x}
+    
+    return find_contacts(particles, particles.keys(), delta_time, cell_size, \
+        min_column, max_column)
 
 class Simulation:
     """
     Simulates the circles.
     """
     
-    def __init__(self, simulation_name="sim", delta_time=0.01, max_time=10.0):
+    def __init__(self, simulation_name="sim", delta_time=0.01, max_time=10.0, \
+        merging=False, workers=1):
         """
         Initializes the simulation.
         Every particle is a list of the form 
             [id, position, velocity, mass, radius].
+        If `merging` is True, circles that touch during an update merge into 
+        one circle. If `workers` is greater than one, the contacts are found 
+        in parallel by a pool of `workers` processes, each searching a 
+        region of space. The result is equal to the serial result.
         """
         # Set simulation name member variable.
         self.simulation_name = simulation_name
@@ -40,6 +263,16 @@ class Simulation:
         # Counts the number of times the simulation has been saved. This will 
         # be used in the names of the save files.
         self.saved_counter = 0
+        
+        # Set merging member variable.
+        self.merging = merging
+        
+        # Initialize parallel execution variables. The pool and the shared 
+        # particle array are only created when they are first needed.
+        self.workers = workers
+        self.pool = None
+        self.shared_particles = None
+        self.capacity = 0
     
     def initialize_particles(self, amount, spawn_range, random_velocity=True):
         """
@@ -83,7 +316,7 @@ class Simulation:
         self.simdata[self.timestep] = {"current_time": self.time, \
             "max_time": self.max_time, "timestep": self.timestep, \
             "number_of_particles": len(self.particles), \
-            "particles": self.particles}
+            "particles": copy.deepcopy(self.particles)}
     
     def run(self):
         """
@@ -104,11 +337,16 @@ class Simulation:
         # Update timing variables.
         if self.done or self.time >= self.max_time:
             self.done = True
+            self.close_pool()
             return
         
         self.timestep += 1
         self.time = self.timestep * self.delta_time
         
+        # Merge circles that touch during this update.
+        if self.merging:
+            self.merge_particles()
+        
         # Update positions.
         for index, particle in enumerate(self.particles):
             # Unpack particle.
@@ -160,3 +398,196 @@ class Simulation:
                 # Save to file.
                 with open(filename, "wb") as file:
                     pickle.dump(self.simdata, file)
+    
+    def merge_particles(self):
+        """
+        Merges the circles that touch within the next `delta_time`, one 
+        contact at a time in order of contact time. The merged circle 
+        conserves mass and momentum, and has an area equal to the sum of the 
+        areas of the merging circles. It continues from the center of mass 
+        of the merging circles at the contact time, and is tested against 
+        the other circles for the remainder of the update, so chains of 
+        contacts within one update are resolved as well.
+        
+        The contacts are found by `find_contacts`, in parallel by 
+        `find_contacts_parallel` if there are multiple workers. The 
+        candidates of a merged circle are found in a grid of the centers of 
+        the path boxes. Positions are kept as positions at the start of the 
+        update, the position of a merged circle is the position its center 
+        of mass had at the start of the update, which moves with the merged 
+        velocity.
+        """
+        particles = self.particles
+        
+        # Find contacts. Every contact is a tuple of the form (contact_time, 
+        # index1, index2, version1, version2), the versions are increased 
+        # when a particle merges, they are used to ignore contacts of 
+        # particles which have changed since.
+        cell_size = get_cell_size(particles, self.delta_time)
+        if self.workers > 1 and len(particles) > 0:
+            contacts, large, max_side = self.find_contacts_parallel(cell_size)
+        else:
+            contacts, large, max_side = find_contacts(particles, \
+                range(len(particles)), self.delta_time, cell_size)
+        contacts = [contact + (0, 0) for contact in contacts]
+        heapq.heapify(contacts)
+        versions = [0] * len(particles)
+        large = set(large)
+        
+        # Grid of the centers of the path boxes that are not large, it is 
+        # only created when the first circles merge.
+        centers = None
+        
+        # Resolve contacts in order of contact time.
+        while len(contacts) > 0:
+            contact_time, index1, index2, version1, version2 = \
+                heapq.heappop(contacts)
+            if particles[index1] is None or particles[index2] is None \
+                or not versions[index1] == version1 \
+                or not versions[index2] == version2:
+                continue
+            
+            # The heaviest particle keeps its id, the lowest id on a tie.
+            particle1 = particles[index1]
+            particle2 = particles[index2]
+            if (particle2[3], -particle2[0]) > (particle1[3], -particle1[0]):
+                particle1, particle2 = particle2, particle1
+            
+            # Calculate merged properties.
+            mass1 = particle1[3]
+            mass2 = particle2[3]
+            mass = mass1 + mass2
+            position = [(mass1 * particle1[1][axis] \
+                + mass2 * particle2[1][axis]) / mass for axis in range(2)]
+            velocity = [(mass1 * particle1[2][axis] \
+                + mass2 * particle2[2][axis]) / mass for axis in range(2)]
+            radius = math.sqrt(particle1[4] ** 2 + particle2[4] ** 2)
+            merged = [particle1[0], position, velocity, mass, radius]
+            
+            # Replace the first particle and remove the second particle.
+            particles[index1] = merged
+            particles[index2] = None
+            versions[index1] += 1
+            
+            # Create the grid of centers.
+            if centers is None:
+                centers = {}
+                half_time = self.delta_time / 2
+                for index, particle in enumerate(particles):
+                    if particle is None or index in large:
+                        continue
+                    centers.setdefault((math.floor((particle[1][0] \
+                        + particle[2][0] * half_time) / cell_size), \
+                        math.floor((particle[1][1] \
+                        + particle[2][1] * half_time) / cell_size)), \
+                        []).append(index)
+            
+            # Find the contacts of the remaining path of the merged particle. 
+            # A merged particle with a large path box is tested against 
+            # every particle. Else it is inserted into the grid of centers, 
+            # and tested against the particles with a center close enough 
+            # for the path boxes to overlap and the particles with large 
+            # path boxes.
+            box = get_path_box(merged, contact_time, self.delta_time)
+            cells = get_grid_range(box, cell_size)
+            if (cells[2] - cells[0] + 1) * (cells[3] - cells[1] + 1) \
+                > MAX_GRID_CELLS:
+                large.add(index1)
+                candidates = range(len(particles))
+            else:
+                large.discard(index1)
+                max_side = max(max_side, box[2] - box[0], box[3] - box[1])
+                center_x = (box[0] + box[2]) / 2
+                center_y = (box[1] + box[3]) / 2
+                centers.setdefault((math.floor(center_x / cell_size), \
+                    math.floor(center_y / cell_size)), []).append(index1)
+                candidates = set(large)
+                for cell_x in range(\
+                    math.floor((center_x - max_side) / cell_size), \
+                    math.floor((center_x + max_side) / cell_size) + 1):
+                    for cell_y in range(\
+                        math.floor((center_y - max_side) / cell_size), \
+                        math.floor((center_y + max_side) / cell_size) + 1):
+                        candidates.update(centers.get((cell_x, cell_y), []))
+            for index in candidates:
+                if index == index1 or particles[index] is None:
+                    continue
+                new_contact_time = get_contact_time(merged, particles[index], \
+                    self.delta_time, contact_time)
+                if new_contact_time is not None:
+                    first, second = sorted((index1, index))
+                    heapq.heappush(contacts, (new_contact_time, first, \
+                        second, versions[first], versions[second]))
+        
+        # Remove merged particles.
+        self.particles = [particle for particle in particles \
+            if particle is not None]
+    
+    def find_contacts_parallel(self, cell_size):
+        """
+        Finds the contacts of the particles within the next `delta_time` in 
+        a pool of `workers` processes. The particles are copied into a 
+        shared array, and space is split into one region of grid columns 
+        per worker. The borders of the regions are quantiles of the x 
+        positions of a sample of particles, so every region contains about 
+        as many particles. Every worker runs `find_contacts` for its region 
+        and its halo. Returns the combined results in the form of 
+        `find_contacts`.
+        """
+        particles = self.particles
+        number_of_particles = len(particles)
+        
+        # Create the shared particle array and the pool, again if the array 
+        # is too small. The workers are spawned instead of forked, forked 
+        # workers would gradually copy the memory of all particles.
+        if self.pool is None or number_of_particles > self.capacity:
+            self.close_pool()
+            context = multiprocessing.get_context("spawn")
+            self.capacity = number_of_particles
+            self.shared_particles = context.RawArray("d", 5 * self.capacity)
+            self.pool = context.Pool(self.workers, \
+                initializer=initialize_worker, \
+                initargs=(self.shared_particles,))
+        
+        # Copy the particles into the shared array column by column.
+        columns = [[particle[1][0] for particle in particles], \
+            [particle[1][1] for particle in particles], \
+            [particle[2][0] for particle in particles], \
+            [particle[2][1] for particle in particles], \
+            [particle[4] for particle in particles]]
+        for column, values in enumerate(columns):
+            self.shared_particles[column * self.capacity:\
+                column * self.capacity + number_of_particles] = values
+        
+        # Split space into regions of grid columns.
+        step = max(number_of_particles // CELL_SIZE_SAMPLES, 1)
+        sample = sorted(particle[1][0] for particle in particles[::step])
+        borders = [None] + [math.floor(sample[len(sample) * region \
+            // self.workers] / cell_size) \
+            for region in range(1, self.workers)] + [None]
+        
+        # Find the contacts of every region in parallel and combine them.
+        results = self.pool.starmap(find_region_contacts, \
+            [(number_of_particles, self.capacity, self.delta_time, \
+            cell_size, borders[region], borders[region + 1]) \
+            for region in range(self.workers)])
+        contacts = []
+        large = []
+        max_side = 0
+        for region_contacts, region_large, region_max_side in results:
+            contacts.extend(region_contacts)
+            large.extend(region_large)
+            max_side = max(max_side, region_max_side)
+        return contacts, large, max_side
+    
+    def close_pool(self):
+        """
+        Terminates the worker processes and releases the shared particle 
+        array if the pool exists.
+        """
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        self.shared_particles = None
+        self.capacity = 0
@@ -0,0 +1,368 @@
+"""
+Functions for reading the save files written by the Simulation class, and 
+for reading and writing the compact snapshot format.
+
+The compact format of a simulation consists of two files:
+    - `snapshots.bin` contains a block for every timestep in order. The 
+      particles of a timestep are sorted into a grid of square tiles, a 
+      block starts with the tile table followed by a compressed block for 
+      every tile. The tile table contains the bounding boxes of the circles 
+      of every tile as doubles followed by the sizes of the compressed 
+      blocks as 64-bit integers. A compressed block contains its particles 
+      in columns: the ids, x positions, y positions, x velocities, y 
+      velocities, masses, and radii. Timesteps with few particles are 
+      stored as a single tile.
+    - `snapshots.pickle` contains the format version followed by the 
+      index, a dictionary of arrays containing the timestep, current time, 
+      max time, number of particles, number of tiles, and the offset and 
+      size of the block of every timestep.
+The index is written last, so a simulation only counts as compact when the 
+conversion completed. Simulations converted to an older version of the 
+format do not count as compact.
+"""
+import array
+import bisect
+import math
+import os
+import pickle
+import sys
+import zlib
+
+# Version of the compact format, stored at the start of the index file. 
+# Version 1 had no tiles and no version marker, version 2 stored the tiles 
+# in the index.
+COMPACT_FORMAT_VERSION = 3
+
+# Average number of particles per tile when the tile size is chosen 
+# automatically.
+TILE_PARTICLES = 256
+
+# Size in bytes of the tile table entry of a single tile.
+TILE_TABLE_ENTRY_SIZE = 5 * 8
+
+# Keys of the data dictionary of every timestep in the pickle save files.
+TIMESTEP_KEYS = ("current_time", "max_time", "timestep", \
+    "number_of_particles", "particles")
+
+class SaveFileError(Exception):
+    """
+    Raised when a pickle save file cannot be read or does not contain a 
+    chunk of timesteps.
+    """
+
+def get_chunk_index(filename):
+    """
+    Returns the index of the save file named `filename`, or None if the name 
+    is not of the form `timestep<index>.pickle`.
+    """
+    if not (filename.startswith("timestep") and filename.endswith(".pickle")):
+        return None
+    try:
+        return int(filename[len("timestep"):-len(".pickle")])
+    except ValueError:
+        return None
+
+def get_chunk_filenames(simulation_name):
+    """
+    Returns the filenames of the save files of the simulation 
+    `simulation_name`, ordered by their index. Save files with a negative 
+    index are only returned if no other save files exist, this is the case 
+    when the simulation ended before the first chunk was full. Files with 
+    names that are not numbered are ignored.
+    """
+    # Check if the simulation exists.
+    directory = f"saves/{simulation_name}/"
+    if not os.path.isdir(directory):
+        raise Exception(f"Simulation does not exist `{simulation_name}`.")
+    
+    # Search folder.
+    available_indices = []
+    for file in os.listdir(directory):
+        index = get_chunk_index(file)
+        if index is not None:
+            available_indices.append(index)
+    
+    # Only use negative indices if there are no other indices.
+    positive_indices = [index for index in available_indices if index >= 0]
+    if len(positive_indices) > 0:
+        available_indices = positive_indices
+    
+    return [f"{directory}timestep{index}.pickle" \
+        for index in sorted(available_indices)]
+
+def get_missing_chunk_filename(simulation_name):
+    """
+    Returns the filename of the first missing save file of the simulation 
+    `simulation_name`, or None if no save file is missing.
+    """
+    # A single save file with a negative index is complete.
+    filenames = get_chunk_filenames(simulation_name)
+    if filenames == [f"saves/{simulation_name}/timestep-1.pickle"]:
+        return None
+    
+    # Check if any index is missing between zero and the maximum.
+    for index, filename in enumerate(filenames):
+        expected = f"saves/{simulation_name}/timestep{index}.pickle"
+        if not filename == expected:
+            return expected
+    return None
+
+def is_compact(simulation_name):
+    """
+    Returns True if the simulation `simulation_name` has been converted to 
+    the current version of the compact format. Only the version at the 
+    start of the index file is read.
+    """
+    filename = f"saves/{simulation_name}/snapshots.pickle"
+    if not os.path.exists(filename):
+        return False
+    try:
+        with open(filename, "rb") as file:
+            return pickle.load(file) == COMPACT_FORMAT_VERSION
+    except (EOFError, pickle.UnpicklingError):
+        return False
+
+def iterate_timesteps(simulation_name):
+    """
+    Generator yielding the data dictionary of every timestep of the 
+    simulation `simulation_name` in order. The compact format is used if it 
+    exists, else the pickle save files are used.
+    """
+    if is_compact(simulation_name):
+        return iterate_compact_timesteps(simulation_name)
+    return iterate_pickle_timesteps(simulation_name)
+
+def iterate_pickle_timesteps(simulation_name):
+    """
+    Generator yielding the data dictionary of every timestep of the 
+    simulation `simulation_name` in order, read from the pickle save files. 
+    Only one chunk is loaded at a time, so the memory usage is bounded by 
+    the size of the largest chunk. Timesteps that were already yielded by a 
+    previous chunk are skipped. Raises a SaveFileError if a save file cannot 
+    be unpickled, or does not contain a dictionary of timesteps with the 
+    keys `TIMESTEP_KEYS`.
+    """
+    last_timestep = -1
+    for filename in get_chunk_filenames(simulation_name):
+        # Load chunk.
+        try:
+            with open(filename, "rb") as file:
+                chunk = pickle.load(file)
+        except (EOFError, pickle.UnpicklingError, AttributeError, \
+            ImportError, IndexError, ValueError) as error:
+            raise SaveFileError(f"Cannot read save file `{filename}`.") \
+                from error
+        
+        # Check chunk.
+        if not isinstance(chunk, dict) \
+            or not all(isinstance(timestep, int) for timestep in chunk) \
+            or not all(isinstance(data, dict) \
+                and all(key in data for key in TIMESTEP_KEYS) \
+                for data in chunk.values()):
+            raise SaveFileError(f"Save file `{filename}` does not contain " \
+                "a chunk of timesteps.")
+        
+        # Yield timesteps in order.
+        for timestep in sorted(chunk.keys()):
+            if timestep <= last_timestep:
+                continue
+            last_timestep = timestep
+            yield chunk[timestep]
+        
+        # Release chunk before loading the next one.
+        del chunk
+
+def pack_particles(particles):
+    """
+    Packs a list of particles into a compressed block of columns. The 
+    columns are stored little-endian.
+    """
+    columns = [
+        array.array("q", [particle[0] for particle in particles]), 
+        array.array("d", [particle[1][0] for particle in particles]), 
+        array.array("d", [particle[1][1] for particle in particles]), 
+        array.array("d", [particle[2][0] for particle in particles]), 
+        array.array("d", [particle[2][1] for particle in particles]), 
+        array.array("d", [particle[3] for particle in particles]), 
+        array.array("d", [particle[4] for particle in particles])
+    ]
+    
+    if sys.byteorder == "big":
+        for column in columns:
+            column.byteswap()
+    return zlib.compress(b"".join(column.tobytes() for column in columns))
+
+def unpack_particles(data):
+    """
+    Unpacks a compressed block of columns into a list of particles of the 
+    form [id, position, velocity, mass, radius].
+    """
+    data = zlib.decompress(data)
+    number_of_particles = len(data) // (7 * 8)
+    
+    # Split data into columns.
+    columns = [array.array("q", data[:8 * number_of_particles])]
+    for column in range(1, 7):
+        columns.append(array.array("d", \
+            data[8 * column * number_of_particles:\
+                 8 * (column + 1) * number_of_particles]))
+    if sys.byteorder == "big":
+        for column in columns:
+            column.byteswap()
+    
+    ids, pos_x, pos_y, vel_x, vel_y, masses, radii = columns
+    return [[ids[i], [pos_x[i], pos_y[i]], [vel_x[i], vel_y[i]], masses[i], \
+        radii[i]] for i in range(number_of_particles)]
+
+def get_tile_size(particles, tile_particles=TILE_PARTICLES):
+    """
+    Returns the tile size for which the tiles contain `tile_particles` 
+    particles on average, based on the bounding box of the particles. 
+    Returns None if all particles should be stored in a single tile.
+    """
+    if len(particles) <= tile_particles:
+        return None
+    
+    # Calculate area of the bounding box of the positions.
+    width = max(particle[1][0] for particle in particles) \
+        - min(particle[1][0] for particle in particles)
+    height = max(particle[1][1] for particle in particles) \
+        - min(particle[1][1] for particle in particles)
+    if width == 0 or height == 0:
+        return None
+    return math.sqrt(width * height * tile_particles / len(particles))
+
+def pack_timestep(particles, tile_size=None):
+    """
+    Sorts the particles into a grid of square tiles with width and height 
+    `tile_size`, and packs them into the block of a timestep: the tile table 
+    followed by a compressed block for every tile. The tile size is chosen 
+    by `get_tile_size` if `tile_size` is None. Returns the block and the 
+    number of tiles.
+    """
+    if tile_size is None:
+        tile_size = get_tile_size(particles)
+    
+    # Sort particles into tiles.
+    tiles = {}
+    for particle in particles:
+        if tile_size is None:
+            key = (0, 0)
+        else:
+            key = (math.floor(particle[1][0] / tile_size), \
+                math.floor(particle[1][1] / tile_size))
+        tiles.setdefault(key, []).append(particle)
+    
+    # Pack tiles and fill tile table.
+    bounds = array.array("d")
+    sizes = array.array("q")
+    blocks = []
+    for key in sorted(tiles.keys()):
+        tile = tiles[key]
+        bounds.extend((\
+            min(particle[1][0] - particle[4] for particle in tile), \
+            min(particle[1][1] - particle[4] for particle in tile), \
+            max(particle[1][0] + particle[4] for particle in tile), \
+            max(particle[1][1] + particle[4] for particle in tile)))
+        blocks.append(pack_particles(tile))
+        sizes.append(len(blocks[-1]))
+    
+    if sys.byteorder == "big":
+        bounds.byteswap()
+        sizes.byteswap()
+    return bounds.tobytes() + sizes.tobytes() + b"".join(blocks), len(blocks)
+
+def overlaps(bounds, rectangle):
+    """
+    Returns True if the bounding boxes `bounds` and `rectangle`, both of the 
+    form (min_x, min_y, max_x, max_y), overlap.
+    """
+    return bounds[0] <= rectangle[2] and rectangle[0] <= bounds[2] \
+        and bounds[1] <= rectangle[3] and rectangle[1] <= bounds[3]
+
+def create_compact_index():
+    """
+    Returns an empty index of the compact format.
+    """
+    return {"timesteps": array.array("q"), \
+        "current_times": array.array("d"), "max_times": array.array("d"), \
+        "numbers_of_particles": array.array("q"), \
+        "numbers_of_tiles": array.array("q"), \
+        "offsets": array.array("q"), "sizes": array.array("q")}
+
+def find_timestep(index, timestep):
+    """
+    Returns the position of timestep `timestep` in the index, or None if the 
+    timestep does not exist.
+    """
+    position = bisect.bisect_left(index["timesteps"], timestep)
+    if position == len(index["timesteps"]) \
+        or not index["timesteps"][position] == timestep:
+        return None
+    return position
+
+def read_compact_timestep(file, index, position, rectangle=None):
+    """
+    Reads the data dictionary of the timestep at position `position` in the 
+    index from the opened `snapshots.bin` file. If `rectangle` is None all 
+    particles are read, sorted by id. Else only the tiles overlapping the 
+    rectangle (min_x, min_y, max_x, max_y) are read and decoded, the 
+    particles of other tiles are left out. The number of particles is always 
+    the total number of particles of the timestep.
+    """
+    # Read tile table.
+    number_of_tiles = index["numbers_of_tiles"][position]
+    offset = index["offsets"][position]
+    file.seek(offset)
+    table = file.read(number_of_tiles * TILE_TABLE_ENTRY_SIZE)
+    bounds = array.array("d", table[:number_of_tiles * 4 * 8])
+    sizes = array.array("q", table[number_of_tiles * 4 * 8:])
+    if sys.byteorder == "big":
+        bounds.byteswap()
+        sizes.byteswap()
+    
+    # Read tiles.
+    particles = []
+    tile_offset = offset + len(table)
+    for tile in range(number_of_tiles):
+        if rectangle is None \
+            or overlaps(bounds[4 * tile:4 * tile + 4], rectangle):
+            file.seek(tile_offset)
+            particles.extend(unpack_particles(file.read(sizes[tile])))
+        tile_offset += sizes[tile]
+    
+    if rectangle is None:
+        particles.sort(key=lambda particle: particle[0])
+    
+    return {"current_time": index["current_times"][position], \
+        "max_time": index["max_times"][position], \
+        "timestep": index["timesteps"][position], \
+        "number_of_particles": index["numbers_of_particles"][position], \
+        "particles": particles}
+
+def load_compact_index(simulation_name):
+    """
+    Loads the index of the compact format of the simulation 
+    `simulation_name`. Raises an exception if the index was written by 
+    another version of the format.
+    """
+    with open(f"saves/{simulation_name}/snapshots.pickle", "rb") as file:
+        version = pickle.load(file)
+        if not version == COMPACT_FORMAT_VERSION:
+            raise Exception("Unsupported compact format of simulation " \
+                f"`{simulation_name}`, convert it again.")
+        return pickle.load(file)
+
+def iterate_compact_timesteps(simulation_name, index=None):
+    """
+    Generator yielding the data dictionary of every timestep of the 
+    simulation `simulation_name` in order, read from the compact format. 
+    The particles of every timestep are sorted by id. Only one timestep is 
+    in memory at a time. The index is loaded from disk if `index` is None.
+    """
+    if index is None:
+        index = load_compact_index(simulation_name)
+    
+    with open(f"saves/{simulation_name}/snapshots.bin", "rb") as file:
+        for position in range(len(index["timesteps"])):
+            yield read_compact_timestep(file, index, position)
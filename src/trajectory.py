@@ -0,0 +1,144 @@
+"""
+Trajectory index, maps particle ids to their positions over time.
+"""
+import math
+import os
+import pickle
+import struct
+
+from storage import iterate_timesteps
+
+# Every record is of the form (timestep, current_time, x, y).
+RECORD_FORMAT = "<qddd"
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+
+def build_trajectory_index(simulation_name):
+    """
+    Builds the trajectory index of the simulation `simulation_name`. The 
+    records of every particle are stored contiguously and ordered by 
+    timestep in `saves/<simulation_name>/trajectories.bin`, the offsets and 
+    timestep ranges of every particle are stored in 
+    `saves/<simulation_name>/trajectories.pickle`. The save files are 
+    streamed twice, once to determine the lifetime and merge lineage of 
+    every particle and once to write the records.
+    """
+    directory = f"saves/{simulation_name}/"
+    
+    # First pass: determine the first and last timestep of every particle 
+    # and which particle it merged into when it disappeared.
+    particles = {}
+    previous = {}
+    for timestep_data in iterate_timesteps(simulation_name):
+        timestep = timestep_data["timestep"]
+        current = {particle[0]: (particle[1], particle[3]) \
+            for particle in timestep_data["particles"]}
+        
+        # Update lifetimes.
+        for id_ in current:
+            if id_ not in particles:
+                particles[id_] = {"first_timestep": timestep, \
+                    "last_timestep": timestep, "merged_into": None}
+            elif particles[id_]["last_timestep"] != timestep - 1:
+                raise Exception(f"Particle `{id_}` reappeared at timestep " \
+                    f"`{timestep}`.")
+            else:
+                particles[id_]["last_timestep"] = timestep
+        
+        # A particle that disappeared merged into the closest particle 
+        # that gained mass.
+        grown = [(id_, position) for id_, (position, mass) in current.items() \
+            if id_ in previous and mass > previous[id_][1]]
+        for id_ in previous.keys() - current.keys():
+            if len(grown) == 0:
+                continue
+            position = previous[id_][0]
+            particles[id_]["merged_into"] = min(grown, \
+                key=lambda item: math.dist(item[1], position))[0]
+        
+        previous = current
+    
+    # Calculate offsets.
+    offset = 0
+    for id_ in sorted(particles.keys()):
+        particles[id_]["offset"] = offset
+        length = particles[id_]["last_timestep"] \
+            - particles[id_]["first_timestep"] + 1
+        offset += length * RECORD_SIZE
+    
+    # Second pass: write the records of every particle at their offset.
+    with open(f"{directory}trajectories.bin", "wb") as file:
+        file.truncate(offset)
+        for timestep_data in iterate_timesteps(simulation_name):
+            timestep = timestep_data["timestep"]
+            current_time = timestep_data["current_time"]
+            for particle in timestep_data["particles"]:
+                entry = particles[particle[0]]
+                file.seek(entry["offset"] \
+                    + (timestep - entry["first_timestep"]) * RECORD_SIZE)
+                file.write(struct.pack(RECORD_FORMAT, timestep, \
+                    current_time, particle[1][0], particle[1][1]))
+    
+    # Save index.
+    with open(f"{directory}trajectories.pickle", "wb") as file:
+        pickle.dump(particles, file)
+
+class TrajectoryIndex:
+    """
+    Reads particle trajectories from the trajectory index of a simulation.
+    """
+    
+    def __init__(self, simulation_name):
+        """
+        Opens the trajectory index of the simulation `simulation_name`.
+        """
+        directory = f"saves/{simulation_name}/"
+        if not os.path.exists(f"{directory}trajectories.pickle"):
+            raise Exception("Trajectory index does not exist for simulation " \
+                f"`{simulation_name}`.")
+        
+        # Load index and open records file.
+        with open(f"{directory}trajectories.pickle", "rb") as file:
+            self.particles = pickle.load(file)
+        self.file = open(f"{directory}trajectories.bin", "rb")
+    
+    def trajectory(self, id_, start_timestep, end_timestep):
+        """
+        Returns the records of particle `id_` from `start_timestep` up to and 
+        including `end_timestep`, clamped to the lifetime of the particle. 
+        Every record is a tuple of the form (timestep, current_time, x, y). 
+        Only the bytes of the requested records are read.
+        """
+        if id_ not in self.particles:
+            return []
+        entry = self.particles[id_]
+        
+        # Clamp timesteps to the lifetime of the particle.
+        start_timestep = max(start_timestep, entry["first_timestep"])
+        end_timestep = min(end_timestep, entry["last_timestep"])
+        if start_timestep > end_timestep:
+            return []
+        
+        # Read records.
+        self.file.seek(entry["offset"] \
+            + (start_timestep - entry["first_timestep"]) * RECORD_SIZE)
+        data = self.file.read((end_timestep - start_timestep + 1) \
+            * RECORD_SIZE)
+        return list(struct.iter_unpack(RECORD_FORMAT, data))
+    
+    def lineage(self, id_):
+        """
+        Returns the list of particle ids that particle `id_` merged into, in 
+        order, starting with `id_` itself.
+        """
+        lineage = [id_]
+        while id_ in self.particles \
+            and self.particles[id_]["merged_into"] is not None:
+            id_ = self.particles[id_]["merged_into"]
+            lineage.append(id_)
+        return lineage
+    
+    def close(self):
+        """
+        Closes the records file.
+        """
+        self.file.close()
@@ -1,6 +1,7 @@
 """
 Visualization class.
 """
+import math
 import os
 import pickle
 import time
@@ -8,6 +9,9 @@ import time
 import pygame
 
 from camera import Camera
+from storage import find_timestep, is_compact, load_compact_index, \
+    read_compact_timestep
+from trajectory import TrajectoryIndex
 
 class Visualization:
     """
@@ -35,21 +39,40 @@ class Visualization:
         if not os.path.isdir(f"saves/{simulation_name}/"):
             raise Exception(f"Simulation does not exist `{simulation_name}`.")
         
-        # Load simulation properties.
+        # Open the compact format if the simulation has been converted, else 
+        # load simulation properties from the pickle save files.
         self.simprops = {}
-        self.load_simulation_properties()
+        self.compact_index = None
+        self.compact_file = None
+        if is_compact(simulation_name):
+            self.compact_index = load_compact_index(simulation_name)
+            self.compact_file = open(f"saves/{simulation_name}/" \
+                "snapshots.bin", "rb")
+        else:
+            self.load_simulation_properties()
         
         # Load simulation data. Simdata contains the data from a simulation 
         # file at any point in time. It gets overwritten if the next file is 
-        # required to be loaded.
+        # required to be loaded. For the compact format it only contains the 
+        # visible particles of the current timestep.
         self.simdata = {}
         self.current_chunk = 0
-        self.load_next_chunk()
+        if self.compact_index is None:
+            self.load_next_chunk()
         self.timestep = 0
         
         # Create camera object.
         self.camera = Camera()
         
+        # Open trajectory index if it exists. It is used to draw the trails 
+        # of the selected particles, particles are selected by clicking on 
+        # them.
+        self.trajectory_index = None
+        if os.path.exists(f"saves/{simulation_name}/trajectories.pickle"):
+            self.trajectory_index = TrajectoryIndex(simulation_name)
+        self.selected_particles = set()
+        self.trail_length = 200
+        
         # Create display.
         self.display = pygame.display.set_mode(window_dimensions)
         pygame.display.set_caption("Visualizer of simulation " \
@@ -118,6 +141,25 @@ class Visualization:
         self.simdata = chunk
         return True
     
+    def load_visible_timestep(self):
+        """
+        Loads the current timestep from the compact format. Only the tiles 
+        overlapping the part of the simulation visible to the camera are 
+        read and decoded. Returns False if the timestep does not exist.
+        """
+        position = find_timestep(self.compact_index, self.timestep)
+        if position is None:
+            return False
+        
+        # Calculate visible rectangle, extended by the radius of the 
+        # rendered circles.
+        rectangle = self.camera.get_visible_rectangle(self.window_dimensions, \
+            margin=5)
+        
+        self.simdata = {self.timestep: read_compact_timestep(\
+            self.compact_file, self.compact_index, position, rectangle)}
+        return True
+    
     def run(self, fps):
         """
         Main render loop.
@@ -167,6 +209,11 @@ class Visualization:
                         keys_pressed[4] = False
                     if event.key == pygame.K_DOWN:
                         keys_pressed[5] = False
+                
+                # Detect left click, toggles selection of the clicked 
+                # particle.
+                if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+                    self.toggle_selection(event.pos)
             
             # Calculate delta time.
             if last_time == 0:
@@ -185,7 +232,11 @@ class Visualization:
             self.display.fill((0, 0, 0))
             
             # Load new simulation data if required.
-            if self.timestep not in list(self.simdata.keys()):
+            if self.compact_index is not None:
+                running = self.load_visible_timestep()
+                if not running:
+                    continue
+            elif self.timestep not in list(self.simdata.keys()):
                 running = self.load_next_chunk()
                 if not running:
                     continue
@@ -194,19 +245,13 @@ class Visualization:
             timestep_data = self.simdata[self.timestep]
             self.timestep += 1
             
+            # Render trails of the selected particles.
+            self.render_trails(timestep_data["timestep"])
+            
             # Render particles.
             for particle in timestep_data["particles"]:
-                position = particle[1]
-                
-                pos_x = self.camera.get_zoom() \
-                    * (position[0] - self.camera.get_position()[0]) \
-                    + self.window_width // 2
-                pos_y = self.camera.get_zoom() \
-                    * (position[1] - -self.camera.get_position()[1]) \
-                    + self.window_height // 2
-                
                 pygame.draw.circle(self.display, (255, 255, 255), \
-                    (pos_x, pos_y), 5)
+                    self.world_to_screen(particle[1]), 5)
             
             # Render text.
             self.render_text(f"Timestep: {self.timestep}", (10, 10))
@@ -216,6 +261,8 @@ class Visualization:
                 f"{current_time}/{max_time}", (10, 30))
             num_of_particles = timestep_data['number_of_particles']
             self.render_text(f"Particles: {num_of_particles}", (10, 50))
+            num_of_visible = len(timestep_data["particles"])
+            self.render_text(f"Loaded particles: {num_of_visible}", (10, 70))
             
             self.render_text(f"Camera position: " \
                 f"{self.camera.get_position()}", (10, 90))
@@ -230,6 +277,78 @@ class Visualization:
         
         # Quit pygame when the render loop is done.
         pygame.quit()
+        self.close()
+    
+    def close(self):
+        """
+        Closes the files opened by the visualization. Called at the end of 
+        the render loop, must be called manually if the render loop is not 
+        run.
+        """
+        if self.trajectory_index is not None:
+            self.trajectory_index.close()
+            self.trajectory_index = None
+        if self.compact_file is not None:
+            self.compact_file.close()
+            self.compact_file = None
+    
+    def world_to_screen(self, position):
+        """
+        Converts a position in the simulation to a position on the screen.
+        """
+        pos_x = self.camera.get_zoom() \
+            * (position[0] - self.camera.get_position()[0]) \
+            + self.window_width // 2
+        pos_y = self.camera.get_zoom() \
+            * (position[1] - -self.camera.get_position()[1]) \
+            + self.window_height // 2
+        return (pos_x, pos_y)
+    
+    def toggle_selection(self, screen_position):
+        """
+        Selects the particle closest to `screen_position` of the last 
+        rendered timestep, or deselects it if it was already selected. 
+        Particles further than 10 pixels away are ignored.
+        """
+        if self.trajectory_index is None or self.timestep == 0:
+            return
+        
+        # Find closest particle on screen.
+        closest_id = None
+        closest_distance = 10
+        for particle in self.simdata[self.timestep - 1]["particles"]:
+            pos_x, pos_y = self.world_to_screen(particle[1])
+            distance = math.dist((pos_x, pos_y), screen_position)
+            if distance <= closest_distance:
+                closest_id = particle[0]
+                closest_distance = distance
+        if closest_id is None:
+            return
+        
+        # Toggle selection.
+        if closest_id in self.selected_particles:
+            self.selected_particles.remove(closest_id)
+        else:
+            self.selected_particles.add(closest_id)
+    
+    def render_trails(self, timestep):
+        """
+        Renders the trails of the selected particles over the last 
+        `trail_length` timesteps. If a selected particle merged into another 
+        particle, the trail of that particle is rendered instead.
+        """
+        if self.trajectory_index is None:
+            return
+        
+        for id_ in self.selected_particles:
+            for lineage_id in self.trajectory_index.lineage(id_):
+                records = self.trajectory_index.trajectory(lineage_id, \
+                    timestep - self.trail_length, timestep)
+                points = [self.world_to_screen((x, y)) \
+                    for _, _, x, y in records]
+                if len(points) > 1:
+                    pygame.draw.lines(self.display, (255, 255, 0), False, \
+                        points)
     
     def render_text(self, text, position):
         text_surface = self.font.render(text, False, (255, 0, 0))
@@ -0,0 +1,58 @@
+"""
+Run tests by executing  `python -m unittest test.test_analysis`.
+Run linter by executing `pylint src/analysis.py`.
+"""
+import csv
+import shutil
+import unittest
+
+from src.analysis import compute_diagnostics, iterate_diagnostics, \
+    save_diagnostics
+from src.simulation import Simulation
+
+class TestAnalysis(unittest.TestCase):
+    
+    def test_compute_diagnostics(self):
+        # Create timestep data with two particles.
+        timestep_data = {"current_time": 0.5, "max_time": 1.0, \
+            "timestep": 5, "number_of_particles": 2, \
+            "particles": [[0, [0, 0], [1, 0], 1, 1], \
+                          [2, [1, 1], [-1, 2], 4, 2]]}
+        
+        # Compute diagnostics.
+        diagnostics, ids = compute_diagnostics(timestep_data, {0, 1})
+        
+        # Check diagnostics.
+        self.assertEqual(ids, {0, 2})
+        self.assertEqual(diagnostics["timestep"], 5)
+        self.assertEqual(diagnostics["number_of_particles"], 2)
+        self.assertEqual(diagnostics["total_mass"], 5)
+        self.assertEqual(diagnostics["momentum_x"], -3)
+        self.assertEqual(diagnostics["momentum_y"], 8)
+        self.assertEqual(diagnostics["kinetic_energy"], 10.5)
+        self.assertEqual(diagnostics["merges"], 1)
+        self.assertEqual(diagnostics["emissions"], 1)
+    
+    def test_save_diagnostics(self):
+        # Create and run new simulation large enough to write multiple 
+        # chunks, in an empty folder.
+        shutil.rmtree("saves/test_analysis/", ignore_errors=True)
+        sim = Simulation(simulation_name="test_analysis", delta_time=0.01, \
+            max_time=1.0)
+        sim.initialize_particles(amount=50, \
+            spawn_range=((-10, 10), (-10, 10)), random_velocity=True)
+        sim.run()
+        
+        # Check if every timestep is streamed once and in order.
+        timesteps = [diagnostics["timestep"] \
+            for diagnostics in iterate_diagnostics("test_analysis")]
+        self.assertEqual(timesteps, list(range(sim.timestep + 1)))
+        
+        # Save diagnostics and check the particle count and mass.
+        filename = save_diagnostics("test_analysis")
+        with open(filename, "r", newline="") as file:
+            rows = list(csv.DictReader(file))
+        self.assertEqual(len(rows), sim.timestep + 1)
+        for row in rows:
+            self.assertEqual(int(row["number_of_particles"]), 50)
+            self.assertEqual(float(row["total_mass"]), 50)
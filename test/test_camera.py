@@ -87,3 +87,13 @@ class TestCamera(unittest.TestCase):
             else:
                 self.assertTrue(camera.speed * expected_output[1] * 0.99 <= dy)
                 self.assertTrue(camera.speed * expected_output[1] * 1.01 >= dy)
+    
+    def test_get_visible_rectangle(self):
+        # Create camera.
+        camera = Camera(position=(10, 20), zoom=2)
+        
+        # Check visible rectangle with and without margin.
+        self.assertEqual(camera.get_visible_rectangle((100, 50)), \
+            (-15, -32.5, 35, -7.5))
+        self.assertEqual(camera.get_visible_rectangle((100, 50), margin=4), \
+            (-17, -34.5, 37, -5.5))
@@ -0,0 +1,205 @@
+"""
+Run tests by executing  `python -m unittest test.test_conversion`.
+Run linter by executing `pylint src/conversion.py`.
+"""
+import os
+import pickle
+import shutil
+import unittest
+
+from src.conversion import convert_all, convert_simulation
+from src.simulation import Simulation
+from src.storage import is_compact, iterate_compact_timesteps, \
+    iterate_pickle_timesteps, find_timestep, load_compact_index, \
+    read_compact_timestep
+
+class TestConversion(unittest.TestCase):
+    
+    def test_convert_simulation(self):
+        # Create and run new simulation in an empty folder.
+        shutil.rmtree("saves/test_conversion/", ignore_errors=True)
+        sim = Simulation(simulation_name="test_conversion", \
+            delta_time=0.01, max_time=1.0)
+        sim.initialize_particles(amount=50, \
+            spawn_range=((-10, 10), (-10, 10)), random_velocity=True)
+        sim.run()
+        
+        # Convert simulation.
+        report = convert_simulation("test_conversion")
+        
+        # Check report.
+        self.assertTrue(report["converted"])
+        self.assertIsNone(report["error"])
+        self.assertEqual(report["timesteps"], sim.timestep + 1)
+        self.assertEqual(report["particles"], 50 * (sim.timestep + 1))
+        self.assertTrue(report["converted_bytes"] < report["original_bytes"])
+        
+        # Check if the converted data equals the original data.
+        self.assertTrue(is_compact("test_conversion"))
+        self.assertEqual(list(iterate_pickle_timesteps("test_conversion")), \
+            list(iterate_compact_timesteps("test_conversion")))
+        
+        # Check if converting again is refused and leaves the data intact.
+        report = convert_simulation("test_conversion")
+        self.assertFalse(report["converted"])
+        self.assertIsNotNone(report["error"])
+        self.assertEqual(list(iterate_pickle_timesteps("test_conversion")), \
+            list(iterate_compact_timesteps("test_conversion")))
+    
+    def test_convert_simulation_remove_originals(self):
+        # Create and run new simulation in an empty folder.
+        shutil.rmtree("saves/test_conversion/", ignore_errors=True)
+        sim = Simulation(simulation_name="test_conversion", \
+            delta_time=0.01, max_time=1.0)
+        sim.initialize_particles(amount=50, \
+            spawn_range=((-10, 10), (-10, 10)), random_velocity=True)
+        sim.run()
+        timesteps = list(iterate_pickle_timesteps("test_conversion"))
+        
+        # Convert simulation and remove the originals.
+        report = convert_simulation("test_conversion", remove_originals=True)
+        self.assertTrue(report["converted"])
+        self.assertEqual(sorted(os.listdir("saves/test_conversion/")), \
+            ["snapshots.bin", "snapshots.pickle"])
+        
+        # Check if converting again keeps the only copy of the data.
+        report = convert_simulation("test_conversion")
+        self.assertFalse(report["converted"])
+        self.assertEqual(sorted(os.listdir("saves/test_conversion/")), \
+            ["snapshots.bin", "snapshots.pickle"])
+        self.assertTrue(is_compact("test_conversion"))
+        self.assertEqual(list(iterate_compact_timesteps("test_conversion")), \
+            timesteps)
+    
+    def test_convert_partial_simulation(self):
+        # Create folder with a missing and a truncated save file.
+        shutil.rmtree("saves/test_conversion/", ignore_errors=True)
+        os.makedirs("saves/test_conversion/")
+        with open("saves/test_conversion/timestep1.pickle", "wb") as file:
+            file.write(b"\x80\x04")
+        
+        # Check if the missing save file is reported.
+        report = convert_simulation("test_conversion")
+        self.assertFalse(report["converted"])
+        self.assertTrue("timestep0.pickle" in report["error"])
+        
+        # Check if the truncated save file is reported.
+        os.rename("saves/test_conversion/timestep1.pickle", \
+            "saves/test_conversion/timestep0.pickle")
+        report = convert_simulation("test_conversion")
+        self.assertFalse(report["converted"])
+        self.assertFalse(is_compact("test_conversion"))
+        self.assertEqual(os.listdir("saves/test_conversion/"), \
+            ["timestep0.pickle"])
+    
+    def test_read_visible_tiles(self):
+        # Create and run new simulation with particles spread over many 
+        # tiles.
+        shutil.rmtree("saves/test_conversion/", ignore_errors=True)
+        sim = Simulation(simulation_name="test_conversion", \
+            delta_time=0.01, max_time=0.1)
+        sim.initialize_particles(amount=200, \
+            spawn_range=((-100, 100), (-100, 100)), random_velocity=True)
+        sim.run()
+        
+        # Convert simulation with small tiles.
+        report = convert_simulation("test_conversion", tile_size=20)
+        self.assertTrue(report["converted"])
+        index = load_compact_index("test_conversion")
+        position = find_timestep(index, sim.timestep)
+        self.assertTrue(index["numbers_of_tiles"][position] > 1)
+        
+        # Read all particles and the particles in a small rectangle.
+        rectangle = (0, 0, 10, 10)
+        with open("saves/test_conversion/snapshots.bin", "rb") as file:
+            all_data = read_compact_timestep(file, index, position)
+            visible_data = read_compact_timestep(file, index, position, \
+                rectangle)
+        
+        # Check if every particle in the rectangle was read, and if not all 
+        # particles were read.
+        self.assertEqual(visible_data["number_of_particles"], 200)
+        self.assertTrue(len(visible_data["particles"]) < 200)
+        visible_ids = {particle[0] for particle in visible_data["particles"]}
+        for id_, position, _, _, radius in all_data["particles"]:
+            if -radius <= position[0] <= 10 + radius \
+                and -radius <= position[1] <= 10 + radius:
+                self.assertTrue(id_ in visible_ids)
+    
+    def test_convert_old_format(self):
+        # Create and run new simulation in an empty folder.
+        shutil.rmtree("saves/test_conversion/", ignore_errors=True)
+        sim = Simulation(simulation_name="test_conversion", \
+            delta_time=0.01, max_time=0.1)
+        sim.initialize_particles(amount=10, \
+            spawn_range=((-10, 10), (-10, 10)), random_velocity=True)
+        sim.run()
+        
+        # Write an index without version, like the first compact format.
+        with open("saves/test_conversion/snapshots.pickle", "wb") as file:
+            pickle.dump({0: {"offset": 0, "size": 0}}, file)
+        
+        # Check if the old format does not count as compact, and is 
+        # replaced when converting again.
+        self.assertFalse(is_compact("test_conversion"))
+        report = convert_simulation("test_conversion")
+        self.assertTrue(report["converted"])
+        self.assertTrue(is_compact("test_conversion"))
+        self.assertEqual(len(load_compact_index("test_conversion")\
+            ["timesteps"]), sim.timestep + 1)
+    
+    def test_convert_simulation_many_tiles(self):
+        # Create and run new simulation with enough particles to be stored 
+        # in multiple tiles.
+        shutil.rmtree("saves/test_conversion/", ignore_errors=True)
+        sim = Simulation(simulation_name="test_conversion", \
+            delta_time=0.01, max_time=0.2)
+        sim.initialize_particles(amount=1000, \
+            spawn_range=((-500, 500), (-500, 500)), random_velocity=True)
+        sim.run()
+        
+        # Convert simulation with automatic tile size.
+        report = convert_simulation("test_conversion")
+        self.assertTrue(report["converted"])
+        
+        # Check if every timestep has multiple tiles and if the converted 
+        # data is smaller than the original data.
+        index = load_compact_index("test_conversion")
+        self.assertTrue(min(index["numbers_of_tiles"]) > 1)
+        self.assertTrue(report["converted_bytes"] < report["original_bytes"])
+        self.assertEqual(list(iterate_pickle_timesteps("test_conversion")), \
+            list(iterate_compact_timesteps("test_conversion")))
+    
+    def test_convert_all_with_bad_simulation(self):
+        # Create and run a good simulation with a stray save file that is 
+        # not numbered.
+        shutil.rmtree("saves/test_conversion/", ignore_errors=True)
+        shutil.rmtree("saves/test_conversion_bad/", ignore_errors=True)
+        sim = Simulation(simulation_name="test_conversion", \
+            delta_time=0.01, max_time=0.1)
+        sim.initialize_particles(amount=10, \
+            spawn_range=((-10, 10), (-10, 10)), random_velocity=True)
+        sim.run()
+        with open("saves/test_conversion/timestep_old.pickle", "wb") as file:
+            pickle.dump({}, file)
+        
+        # Create a bad simulation with a save file that is not a chunk.
+        os.makedirs("saves/test_conversion_bad/")
+        with open("saves/test_conversion_bad/timestep0.pickle", "wb") as file:
+            pickle.dump([1, 2, 3], file)
+        
+        # Convert both simulations in a pool.
+        reports = convert_all(workers=2, remove_originals=True, \
+            simulation_names=["test_conversion", "test_conversion_bad"])
+        
+        # Check if the good simulation was converted and keeps the stray 
+        # file, and if the bad simulation was reported and left intact.
+        good_report, bad_report = reports
+        self.assertTrue(good_report["converted"])
+        self.assertEqual(good_report["timesteps"], sim.timestep + 1)
+        self.assertEqual(sorted(os.listdir("saves/test_conversion/")), \
+            ["snapshots.bin", "snapshots.pickle", "timestep_old.pickle"])
+        self.assertFalse(bad_report["converted"])
+        self.assertTrue("timestep0.pickle" in bad_report["error"])
+        self.assertEqual(os.listdir("saves/test_conversion_bad/"), \
+            ["timestep0.pickle"])
@@ -2,9 +2,12 @@
 Run tests by executing  `python -m unittest test.test_simulation`.
 Run linter by executing `pylint src/simulation.py`.
 """
+import copy
+import math
+import random as rnd
 import unittest
 
-from src.simulation import Simulation
+from src.simulation import Simulation, get_cell_size, get_contact_time
 
 class TestSimulation(unittest.TestCase):
     
@@ -72,6 +75,21 @@ class TestSimulation(unittest.TestCase):
             # Check if the velocity is zero.
             self.assertTrue(velocity[0] == 0 and velocity[1] == 0)
     
+    def test_init_particles_saved(self):
+        # Create new simulation and initialize particles with random 
+        # velocity.
+        sim = Simulation(simulation_name="test_sim", delta_time=0.01, \
+            max_time=1)
+        sim.initialize_particles(amount=5, spawn_range=((-1, 1), (-1, 1)), \
+            random_velocity=True)
+        initial_particles = copy.deepcopy(sim.particles)
+        
+        # Check if the saved initial state is not changed by updates.
+        sim.update()
+        sim.update()
+        self.assertEqual(sim.simdata[0]["particles"], initial_particles)
+        self.assertNotEqual(sim.simdata[2]["particles"], initial_particles)
+    
     def test_run(self):
         # Create new simulation.
         sim = Simulation(simulation_name="test_sim", delta_time=0.01, \
@@ -133,3 +151,149 @@ class TestSimulation(unittest.TestCase):
             abs(new_position_prediction[0] - new_position[0]) < 0.000000001)
         self.assertTrue(\
             abs(new_position_prediction[1] - new_position[1]) < 0.000000001)
+    
+    def test_get_contact_time(self):
+        # Two circles moving towards each other touch after 0.3 seconds.
+        particle1 = [0, [-10, 0], [30, 0], 1, 1]
+        particle2 = [1, [10, 0], [-30, 0], 1, 1]
+        self.assertAlmostEqual(get_contact_time(particle1, particle2, 1), 0.3)
+        self.assertIsNone(get_contact_time(particle1, particle2, 0.1))
+        
+        # Two circles passing each other do not touch.
+        particle2 = [1, [10, 3], [-30, 0], 1, 1]
+        self.assertIsNone(get_contact_time(particle1, particle2, 1))
+        
+        # Two overlapping circles touch immediately.
+        particle2 = [1, [-9, 0], [0, 0], 1, 1]
+        self.assertEqual(get_contact_time(particle1, particle2, 1), 0)
+    
+    def test_merge_particles(self):
+        # Run the same head-on collision with a large and a small time step. 
+        # With the large time step the circles would pass through each other 
+        # if only the positions after every update were checked.
+        results = []
+        for delta_time in [0.5, 0.001]:
+            sim = Simulation(simulation_name="test_sim", \
+                delta_time=delta_time, max_time=1, merging=True)
+            sim.particles = [[0, [-10, 0], [30, 0], 1, 1], \
+                             [1, [10, 0.5], [-30, 0], 3, 1.5], \
+                             [2, [0, 20], [0, 0], 1, 1]]
+            sim.run()
+            results.append(sim.particles)
+        
+        # Check if both runs merged the same circles into the same circle.
+        for particles in results:
+            self.assertEqual(len(particles), 2)
+            merged = particles[0]
+            self.assertEqual(merged[0], 1)
+            self.assertEqual(merged[3], 4)
+            self.assertAlmostEqual(merged[4], math.sqrt(1 + 1.5 ** 2))
+            self.assertAlmostEqual(merged[2][0], -15)
+            self.assertAlmostEqual(merged[2][1], 0)
+            self.assertEqual(particles[1][0], 2)
+        
+        # Check if both runs end with the merged circle at the same place.
+        self.assertAlmostEqual(results[0][0][1][0], results[1][0][1][0])
+        self.assertAlmostEqual(results[0][0][1][1], results[1][0][1][1])
+    
+    def test_merge_particles_chain(self):
+        # Run a chain of contacts with large and small time steps. With the 
+        # largest time step the first two circles merge and the merged 
+        # circle reaches the third circle within the same update.
+        results = []
+        for delta_time in [2, 0.5, 0.001]:
+            sim = Simulation(simulation_name="test_sim", \
+                delta_time=delta_time, max_time=4, merging=True)
+            sim.particles = [[0, [-10, 0], [40, 0], 1, 1], \
+                             [1, [0, 0], [0, 0], 1, 1], \
+                             [2, [20, 0], [0, 0], 1, 1]]
+            sim.run()
+            results.append(sim.particles)
+        
+        # Check if every run merged all circles into one circle.
+        for particles in results:
+            self.assertEqual(len(particles), 1)
+            self.assertEqual(particles[0][3], 3)
+            self.assertAlmostEqual(particles[0][1][0], 170 / 3)
+            self.assertAlmostEqual(particles[0][1][1], 0)
+    
+    def test_merge_particles_reference(self):
+        # Create many circles with random velocities in a small area.
+        rnd.seed(3)
+        initial_particles = [[id_, \
+            [rnd.uniform(-20, 20), rnd.uniform(-20, 20)], \
+            [rnd.uniform(-20, 20), rnd.uniform(-20, 20)], 1, 1] \
+            for id_ in range(40)]
+        
+        # Run the circles with a large time step and with a fine time step 
+        # as reference.
+        results = []
+        for delta_time in [0.25, 0.0005]:
+            sim = Simulation(simulation_name="test_sim", \
+                delta_time=delta_time, max_time=1, merging=True)
+            sim.particles = copy.deepcopy(initial_particles)
+            sim.run()
+            results.append(sorted(sim.particles))
+        
+        # Check if both runs merged the same circles into the same circles.
+        coarse, reference = results
+        self.assertTrue(len(reference) < len(initial_particles))
+        self.assertEqual([(particle[0], particle[3]) for particle in coarse], \
+            [(particle[0], particle[3]) for particle in reference])
+        for particle, reference_particle in zip(coarse, reference):
+            self.assertAlmostEqual(particle[1][0], reference_particle[1][0])
+            self.assertAlmostEqual(particle[1][1], reference_particle[1][1])
+    
+    def test_merge_particles_fast_outlier(self):
+        # Create a lattice of resting circles and one fast circle crossing 
+        # the lattice diagonally.
+        initial_particles = [[id_, [5 * (id_ % 20), 5 * (id_ // 20)], \
+            [0, 0], 1, 1] for id_ in range(400)]
+        initial_particles.append([400, [-50, -50], [2000, 2000], 1, 1])
+        
+        # Check if the fast circle does not change the grid cell size.
+        self.assertEqual(get_cell_size(initial_particles, 0.1), 2)
+        
+        # Run the circles with a single update and with a fine time step as 
+        # reference.
+        results = []
+        for delta_time in [0.1, 0.001]:
+            sim = Simulation(simulation_name="test_sim", \
+                delta_time=delta_time, max_time=0.1, merging=True)
+            sim.particles = copy.deepcopy(initial_particles)
+            sim.run()
+            results.append(sorted(sim.particles))
+        
+        # Check if both runs merged the same circles into the same circles.
+        coarse, reference = results
+        self.assertTrue(len(reference) < len(initial_particles) - 5)
+        self.assertEqual([(particle[0], particle[3]) for particle in coarse], \
+            [(particle[0], particle[3]) for particle in reference])
+        for particle, reference_particle in zip(coarse, reference):
+            self.assertAlmostEqual(particle[1][0], reference_particle[1][0])
+            self.assertAlmostEqual(particle[1][1], reference_particle[1][1])
+    
+    def test_merge_particles_parallel(self):
+        # Create many circles with random velocities and one fast circle.
+        rnd.seed(5)
+        initial_particles = [[id_, \
+            [rnd.uniform(-60, 60), rnd.uniform(-60, 60)], \
+            [rnd.uniform(-20, 20), rnd.uniform(-20, 20)], 1, 1] \
+            for id_ in range(300)]
+        initial_particles.append([300, [-60, 0], [1000, 10], 1, 1])
+        
+        # Run the circles serially and with multiple workers.
+        results = []
+        for workers in [1, 2, 3]:
+            sim = Simulation(simulation_name="test_sim", delta_time=0.05, \
+                max_time=0.5, merging=True, workers=workers)
+            sim.particles = copy.deepcopy(initial_particles)
+            sim.run()
+            self.assertIsNone(sim.pool)
+            results.append(sim.particles)
+        
+        # Check if every run merged the same circles into the same circles.
+        serial = results[0]
+        self.assertTrue(len(serial) < len(initial_particles) - 20)
+        for particles in results[1:]:
+            self.assertEqual(particles, serial)
@@ -0,0 +1,74 @@
+"""
+Run tests by executing  `python -m unittest test.test_trajectory`.
+Run linter by executing `pylint src/trajectory.py`.
+"""
+import os
+import pickle
+import shutil
+import unittest
+
+from src.simulation import Simulation
+from src.trajectory import TrajectoryIndex, build_trajectory_index
+
+class TestTrajectory(unittest.TestCase):
+    
+    def test_trajectory(self):
+        # Create and run new simulation in an empty folder.
+        shutil.rmtree("saves/test_trajectory/", ignore_errors=True)
+        sim = Simulation(simulation_name="test_trajectory", delta_time=0.01, \
+            max_time=1.0)
+        sim.initialize_particles(amount=50, \
+            spawn_range=((-10, 10), (-10, 10)), random_velocity=True)
+        initial_particles = [[particle[0], particle[1][:], particle[2][:]] \
+            for particle in sim.particles]
+        sim.run()
+        
+        # Build and open trajectory index.
+        build_trajectory_index("test_trajectory")
+        index = TrajectoryIndex("test_trajectory")
+        
+        # Check the trajectory of every particle against its velocity.
+        for id_, position, velocity in initial_particles:
+            records = index.trajectory(id_, 10, 20)
+            self.assertEqual([record[0] for record in records], \
+                list(range(10, 21)))
+            for timestep, _, pos_x, pos_y in records:
+                self.assertAlmostEqual(pos_x, \
+                    position[0] + timestep * sim.delta_time * velocity[0])
+                self.assertAlmostEqual(pos_y, \
+                    position[1] + timestep * sim.delta_time * velocity[1])
+        
+        # Check if the requested range is clamped to the lifetime.
+        records = index.trajectory(0, -5, 1000)
+        self.assertEqual(len(records), sim.timestep + 1)
+        self.assertEqual(index.trajectory(1000, 0, 10), [])
+        index.close()
+    
+    def test_lineage(self):
+        # Write a chunk in which particle 1 merges into particle 0 at 
+        # timestep 1.
+        shutil.rmtree("saves/test_trajectory/", ignore_errors=True)
+        os.makedirs("saves/test_trajectory/")
+        simdata = {
+            0: {"current_time": 0, "max_time": 1, "timestep": 0, \
+                "number_of_particles": 3, \
+                "particles": [[0, [0, 0], [0, 0], 1, 1], \
+                              [1, [1, 0], [0, 0], 1, 1], \
+                              [2, [9, 0], [0, 0], 1, 1]]},
+            1: {"current_time": 1, "max_time": 1, "timestep": 1, \
+                "number_of_particles": 2, \
+                "particles": [[0, [0.5, 0], [0, 0], 2, 1.4], \
+                              [2, [9, 0], [0, 0], 1, 1]]}
+        }
+        with open("saves/test_trajectory/timestep0.pickle", "wb") as file:
+            pickle.dump(simdata, file)
+        
+        # Build and open trajectory index.
+        build_trajectory_index("test_trajectory")
+        index = TrajectoryIndex("test_trajectory")
+        
+        # Check lineages.
+        self.assertEqual(index.lineage(1), [1, 0])
+        self.assertEqual(index.lineage(2), [2])
+        self.assertEqual(len(index.trajectory(1, 0, 1)), 1)
+        index.close()
@@ -46,3 +46,6 @@ class TestVisualization(unittest.TestCase):
         self.assertIsInstance(vis.simprops, dict)
         self.assertTrue("indices" in vis.simprops.keys())
         self.assertTrue("max_index" in vis.simprops.keys())
+        
+        # Close visualization.
+        vis.close()